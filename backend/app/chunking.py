@@ -0,0 +1,105 @@
+from typing import List, Optional, Tuple
+
+
+class RecursiveTextSplitter:
+    """Drop-in replacement for langchain's RecursiveCharacterTextSplitter.split_text.
+    
+    Produces the same chunks (separators kept at the start of the following piece,
+    chunks stripped) but works on offsets into the original string: separators are
+    located with str.find and each chunk is sliced once, instead of building and
+    re-joining every intermediate piece.
+    """
+    
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: Optional[List[str]] = None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or ["\n\n", "\n", " ", ""]
+    
+    def split_text(self, text: str) -> List[str]:
+        """Split text into chunks of at most chunk_size characters where possible."""
+        return [chunk for _, chunk in self.split_text_with_offsets(text)]
+    
+    def split_text_with_offsets(self, text: str) -> List[Tuple[int, str]]:
+        """Split text like split_text, pairing each chunk with its start offset in text."""
+        chunks: List[Tuple[int, str]] = []
+        self._split(text, 0, len(text), self.separators, chunks)
+        return chunks
+    
+    def _split(self, text: str, start: int, end: int, separators: List[str], chunks: List[Tuple[int, str]]):
+        """Split text[start:end] on the first separator it contains, recursing into oversized pieces."""
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator, remaining = candidate, separators[i + 1:]
+                break
+        
+        if separator == "":
+            # Every character is its own piece, so the greedy merge reduces to fixed windows
+            self._merge_characters(text, start, end, chunks)
+            return
+        
+        good: List[Tuple[int, int]] = []
+        for piece in self._pieces(text, start, end, separator):
+            if piece[1] - piece[0] < self.chunk_size:
+                good.append(piece)
+                continue
+            if good:
+                self._merge(text, good, chunks)
+                good = []
+            if remaining:
+                self._split(text, piece[0], piece[1], remaining, chunks)
+            else:
+                chunks.append((piece[0], text[piece[0]:piece[1]]))
+        if good:
+            self._merge(text, good, chunks)
+    
+    def _pieces(self, text: str, start: int, end: int, separator: str) -> List[Tuple[int, int]]:
+        """Return non-empty (start, end) pieces, each after the first beginning with the separator."""
+        pieces = []
+        step = len(separator)
+        found = text.find(separator, start, end)
+        while found != -1:
+            if found > start:
+                pieces.append((start, found))
+            start = found
+            found = text.find(separator, found + step, end)
+        if end > start:
+            pieces.append((start, end))
+        return pieces
+    
+    def _merge(self, text: str, pieces: List[Tuple[int, int]], chunks: List[Tuple[int, str]]):
+        """Greedily pack adjacent pieces into chunks, carrying up to chunk_overlap characters over."""
+        first, total = 0, 0
+        for i, (start, end) in enumerate(pieces):
+            length = end - start
+            if total + length > self.chunk_size and i > first:
+                self._emit(text, pieces[first][0], pieces[i - 1][1], chunks)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= pieces[first][1] - pieces[first][0]
+                    first += 1
+            total += length
+        self._emit(text, pieces[first][0], pieces[-1][1], chunks)
+    
+    def _merge_characters(self, text: str, start: int, end: int, chunks: List[Tuple[int, str]]):
+        """Pack single characters into chunk_size windows overlapping by chunk_overlap."""
+        step = self.chunk_size - min(self.chunk_overlap, self.chunk_size - 1)
+        while end - start > self.chunk_size:
+            self._emit(text, start, start + self.chunk_size, chunks)
+            start += step
+        if end > start:
+            self._emit(text, start, end, chunks)
+    
+    @staticmethod
+    def _emit(text: str, start: int, end: int, chunks: List[Tuple[int, str]]):
+        chunk = text[start:end].lstrip()
+        start = end - len(chunk)
+        chunk = chunk.rstrip()
+        if chunk:
+            chunks.append((start, chunk))
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from functools import lru_cache
+from functools import cache
 
 
 class Settings(BaseSettings):
@@ -8,12 +8,22 @@ class Settings(BaseSettings):
     
     # Database
     database_url: str = "sqlite:///./refbook.db"  # Default to SQLite for local dev
+    db_pool_size: int = 20
+    db_max_overflow: int = 40
+    db_pool_recycle: int = 3600  # Seconds before a pooled connection is replaced
     
     # ChromaDB
     chroma_persist_directory: str = "./chroma_db"
+    chroma_mode: str = "persistent"  # "persistent" (embedded) or "server"
+    chroma_host: str = "localhost"
+    chroma_port: int = 8000
     
     # Models
     embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_batch_size: int = 64  # Sentences per encoder forward pass
+    embedding_quantize: bool = False  # int8 dynamic quantization when running on CPU
+    embedding_workers: int = 4  # Threads reserved for embedding, apart from the default pool
+    embedding_cache_path: str = "./embedding_cache.db"  # SQLite file caching chunk embeddings
     llm_model: str = "gpt-4o-mini"
     
     # Server
@@ -24,12 +34,19 @@ class Settings(BaseSettings):
     chunk_size: int = 1000
     chunk_overlap: int = 200
     top_k: int = 5
+    max_context_tokens: int = 3000  # Cap on retrieved context sent to the LLM
+    semantic_cache_threshold: float = 0.97  # Cosine similarity for a cache hit
+    semantic_cache_ttl: int = 300  # Seconds retrieved sources stay cached
+    semantic_answer_cache_ttl: int = 1800  # Seconds full answers stay cached
+    semantic_cache_size: int = 1024  # Max entries in each semantic cache
+    chunk_batch_size: int = 128  # Chunks per Chroma write
+    scrape_concurrency: int = 8  # Concurrent scrapes when adding resources in bulk
     
     class Config:
         env_file = ".env"
         extra = "ignore"
 
 
-@lru_cache()
+@cache
 def get_settings() -> Settings:
     return Settings()
@@ -1,25 +1,41 @@
-from sqlalchemy import create_engine, Column, String, Text, DateTime, Integer, Enum as SQLEnum, ForeignKey
+from sqlalchemy import create_engine, event, inspect, text, Index, Column, String, Text, DateTime, Integer, SmallInteger, LargeBinary, ForeignKey
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+from typing import Final
 import enum
-import os
 
 from app.config import get_settings
 
 settings = get_settings()
 
 # Database URL
-DATABASE_URL = settings.database_url
+DATABASE_URL: Final[str] = settings.database_url
+_IS_SQLITE: Final[bool] = DATABASE_URL.startswith("sqlite")
 
 # Create engine
-if DATABASE_URL.startswith("sqlite"):
+if _IS_SQLITE:
     engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _):
+        """Enable WAL so readers don't block on the writer."""
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
 else:
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=True,
+    )
 
 # Session
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 
 # Base class
 Base = declarative_base()
@@ -32,6 +48,31 @@ class ResourceStatusEnum(str, enum.Enum):
     ERROR = "error"
 
 
+_STATUS_TO_CODE = {
+    ResourceStatusEnum.PENDING: 0,
+    ResourceStatusEnum.PROCESSING: 1,
+    ResourceStatusEnum.READY: 2,
+    ResourceStatusEnum.ERROR: 3,
+}
+_CODE_TO_STATUS = {code: status for status, code in _STATUS_TO_CODE.items()}
+
+
+class ResourceStatusType(TypeDecorator):
+    """Store ResourceStatusEnum as a small integer code."""
+    impl = SmallInteger
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return _STATUS_TO_CODE[ResourceStatusEnum(value)]
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return _CODE_TO_STATUS[int(value)]
+
+
 # Database Models
 class ProjectDB(Base):
     __tablename__ = "projects"
@@ -54,7 +95,7 @@ class ResourceDB(Base):
     project_id = Column(String(36), ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
     url = Column(Text, nullable=False)
     name = Column(String(500), nullable=False)
-    status = Column(SQLEnum(ResourceStatusEnum), default=ResourceStatusEnum.PENDING)
+    status = Column(ResourceStatusType, default=ResourceStatusEnum.PENDING)
     chunk_count = Column(Integer, default=0)
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -62,6 +103,10 @@ class ResourceDB(Base):
     
     # Relationships
     project = relationship("ProjectDB", back_populates="resources")
+    
+    __table_args__ = (
+        Index("ix_resources_project_status", "project_id", "status"),
+    )
 
 
 class ShareSessionDB(Base):
@@ -74,15 +119,57 @@ class ShareSessionDB(Base):
     
     # Relationships
     project = relationship("ProjectDB", back_populates="share_sessions")
+    
+    __table_args__ = (
+        Index("ix_share_sessions_project_id", "project_id"),
+    )
+
+
+class ChunkDB(Base):
+    __tablename__ = "chunks"
+    
+    # Full chunk text, zstd-compressed; Chroma only keeps an excerpt next to each vector
+    id = Column(String(64), primary_key=True)
+    resource_id = Column(String(36), ForeignKey("resources.id", ondelete="CASCADE"), nullable=False)
+    content = Column(LargeBinary, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_chunks_resource_id", "resource_id"),
+    )
+
+
+def _migrate_resource_status():
+    """Convert a legacy string/enum resources.status column to integer codes."""
+    columns = {c["name"]: c["type"] for c in inspect(engine).get_columns("resources")}
+    if isinstance(columns["status"], Integer):
+        return
+    
+    codes = " ".join(f"WHEN '{status.name}' THEN {code}" for status, code in _STATUS_TO_CODE.items())
+    names = ", ".join(f"'{status.name}'" for status in _STATUS_TO_CODE)
+    with engine.begin() as conn:
+        if _IS_SQLITE:
+            # SQLite can't alter column types; the TEXT-affinity codes are read back via int()
+            conn.execute(text(f"UPDATE resources SET status = CASE status {codes} END WHERE status IN ({names})"))
+        else:
+            conn.execute(text(
+                f"ALTER TABLE resources ALTER COLUMN status TYPE SMALLINT "
+                f"USING CASE status::text {codes} END"
+            ))
+            conn.execute(text("DROP TYPE IF EXISTS resourcestatusenum"))
 
 
 def init_db():
     """Initialize database tables."""
     Base.metadata.create_all(bind=engine)
+    _migrate_resource_status()
+    # create_all skips existing tables, so add indexes introduced later
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 
 def get_db():
-    """Get database session."""
+    """Get a database session for the current request."""
     db = SessionLocal()
     try:
         yield db
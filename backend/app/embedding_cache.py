@@ -0,0 +1,62 @@
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """On-disk cache of document embeddings keyed by a hash of (model name, text).
+    
+    Vectors are stored as float16 in a SQLite table, so re-adding or refreshing a
+    page only embeds chunks whose text has not been seen before.
+    """
+    
+    # Stay well below SQLite's bound-parameter limit
+    _QUERY_BATCH = 500
+    
+    def __init__(self, path: str, model_name: str):
+        self.model_name = model_name
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+    
+    def _key(self, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode(), digest_size=16).digest()
+    
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return the cached vector for each text, or None where it is missing."""
+        keys = [self._key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self._QUERY_BATCH):
+                batch = keys[start:start + self._QUERY_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                found.update(rows)
+        return [
+            np.frombuffer(found[key], dtype=np.float16).astype(np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+    
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        """Store vectors for texts."""
+        rows = [
+            (self._key(text), np.asarray(vector, dtype=np.float16).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,15 +1,23 @@
-from fastapi import FastAPI, HTTPException, status
+import hashlib
+import anyio
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 from typing import List
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 
 from app.config import get_settings
+from app.database import engine, get_db
 from app.models import (
     ProjectCreate,
     Project,
-    ProjectList,
     ProjectWithStats,
     ResourceCreate,
+    ResourceBulkCreate,
     Resource,
     ResourceList,
     ChatRequest,
@@ -19,23 +27,33 @@ from app.models import (
     ShareResponse,
 )
 from app.rag_service import rag_service
+from app.scraper import scraper
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown."""
     print("Starting RefBook API...")
-    _ = rag_service.embeddings
+    # Let as many sync handlers run as the DB pool can serve; SQLite keeps SQLAlchemy's default pool
+    if isinstance(engine.pool, QueuePool):
+        anyio.to_thread.current_default_thread_limiter().total_tokens = (
+            engine.pool.size() + engine.pool._max_overflow
+        )
+    rag_service.warmup()
+    await scraper.startup()
     print("RAG service initialized")
     yield
     print("Shutting down RefBook API...")
+    await scraper.shutdown()
+    rag_service.shutdown()
 
 
 app = FastAPI(
     title="RefBook API",
     description="NotebookLM-style RAG service for URL-based knowledge retrieval",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -47,6 +65,21 @@ app.add_middleware(
 )
 
 
+def _not_modified(request: Request, response: Response, *parts) -> bool:
+    """Set a weak ETag derived from parts and report whether the client already has it."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+    etag = f'W/"{digest}"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def _not_modified_response(response: Response) -> Response:
+    """Build an empty 304 response carrying the validators already set on response."""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers))
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -56,9 +89,10 @@ async def health_check():
 # ============ Project Endpoints ============
 
 @app.post("/api/projects", response_model=Project, status_code=status.HTTP_201_CREATED)
-async def create_project(project: ProjectCreate):
+def create_project(project: ProjectCreate, db: Session = Depends(get_db)):
     """Create a new project."""
     result = rag_service.create_project(
+        db=db,
         name=project.name,
         description=project.description
     )
@@ -66,38 +100,30 @@ async def create_project(project: ProjectCreate):
 
 
 @app.get("/api/projects", response_model=List[ProjectWithStats])
-async def list_projects():
+def list_projects(request: Request, response: Response, db: Session = Depends(get_db)):
     """List all projects with stats."""
-    projects = rag_service.get_all_projects()
-    result = []
-    for p in projects:
-        stats = rag_service.get_project_stats(p.id)
-        result.append(ProjectWithStats(
-            **p.model_dump(),
-            resource_count=stats["total"],
-            ready_resource_count=stats["ready"]
-        ))
-    return result
+    projects = rag_service.get_all_projects_with_stats(db)
+    if _not_modified(request, response, [
+        (p.id, p.updated_at, p.resource_count, p.ready_resource_count) for p in projects
+    ]):
+        return _not_modified_response(response)
+    return projects
 
 
 @app.get("/api/projects/{project_id}", response_model=ProjectWithStats)
-async def get_project(project_id: str):
+def get_project(project_id: str, db: Session = Depends(get_db)):
     """Get a specific project."""
-    project = rag_service.get_project(project_id)
+    project = rag_service.get_project_with_stats(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    stats = rag_service.get_project_stats(project_id)
-    return ProjectWithStats(
-        **project.model_dump(),
-        resource_count=stats["total"],
-        ready_resource_count=stats["ready"]
-    )
+    return project
 
 
 @app.put("/api/projects/{project_id}", response_model=Project)
-async def update_project(project_id: str, project: ProjectCreate):
+def update_project(project_id: str, project: ProjectCreate, db: Session = Depends(get_db)):
     """Update a project."""
     result = rag_service.update_project(
+        db=db,
         project_id=project_id,
         name=project.name,
         description=project.description
@@ -108,9 +134,9 @@ async def update_project(project_id: str, project: ProjectCreate):
 
 
 @app.delete("/api/projects/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_project(project_id: str):
+async def delete_project(project_id: str, db: Session = Depends(get_db)):
     """Delete a project and all its resources."""
-    success = await rag_service.delete_project(project_id)
+    success = await rag_service.delete_project(db, project_id)
     if not success:
         raise HTTPException(status_code=404, detail="Project not found")
     return None
@@ -119,12 +145,13 @@ async def delete_project(project_id: str):
 # ============ Resource Endpoints ============
 
 @app.post("/api/projects/{project_id}/resources", response_model=Resource, status_code=status.HTTP_201_CREATED)
-async def create_resource(project_id: str, resource: ResourceCreate):
+async def create_resource(project_id: str, resource: ResourceCreate, db: Session = Depends(get_db)):
     """Add a new resource to a project."""
     try:
         result = await rag_service.add_resource(
+            db=db,
             project_id=project_id,
-            url=resource.url,
+            url=str(resource.url),
             name=resource.name
         )
         return result
@@ -134,39 +161,59 @@ async def create_resource(project_id: str, resource: ResourceCreate):
         raise HTTPException(status_code=500, detail=f"Failed to add resource: {str(e)}")
 
 
+@app.post("/api/projects/{project_id}/resources/bulk", response_model=ResourceList, status_code=status.HTTP_201_CREATED)
+async def create_resources(project_id: str, request: ResourceBulkCreate, db: Session = Depends(get_db)):
+    """Add several resources to a project at once."""
+    try:
+        resources = await rag_service.add_resources(
+            db=db,
+            project_id=project_id,
+            items=[(str(r.url), r.name) for r in request.resources]
+        )
+        return ResourceList(resources=resources, total=len(resources))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to add resources: {str(e)}")
+
+
 @app.get("/api/projects/{project_id}/resources", response_model=ResourceList)
-async def list_resources(project_id: str):
+def list_resources(project_id: str, request: Request, response: Response, db: Session = Depends(get_db)):
     """List all resources in a project."""
-    project = rag_service.get_project(project_id)
+    project = rag_service.get_project(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    resources = rag_service.get_project_resources(project_id)
+    resources = rag_service.get_project_resources(db, project_id)
+    if _not_modified(request, response, [(r.id, r.updated_at) for r in resources]):
+        return _not_modified_response(response)
     return ResourceList(resources=resources, total=len(resources))
 
 
 @app.get("/api/projects/{project_id}/resources/{resource_id}", response_model=Resource)
-async def get_resource(project_id: str, resource_id: str):
+def get_resource(project_id: str, resource_id: str, request: Request, response: Response, db: Session = Depends(get_db)):
     """Get a specific resource."""
-    resource = rag_service.get_resource(resource_id)
+    resource = rag_service.get_resource(db, resource_id)
     if not resource or resource.project_id != project_id:
         raise HTTPException(status_code=404, detail="Resource not found")
+    if _not_modified(request, response, resource.id, resource.updated_at):
+        return _not_modified_response(response)
     return resource
 
 
 @app.delete("/api/projects/{project_id}/resources/{resource_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_resource(project_id: str, resource_id: str):
+async def delete_resource(project_id: str, resource_id: str, db: Session = Depends(get_db)):
     """Delete a resource."""
-    success = await rag_service.delete_resource(project_id, resource_id)
+    success = await rag_service.delete_resource(db, project_id, resource_id)
     if not success:
         raise HTTPException(status_code=404, detail="Resource not found")
     return None
 
 
 @app.post("/api/projects/{project_id}/resources/{resource_id}/refresh", response_model=RefreshResponse)
-async def refresh_resource(project_id: str, resource_id: str):
+async def refresh_resource(project_id: str, resource_id: str, db: Session = Depends(get_db)):
     """Refresh a resource by re-scraping."""
     try:
-        resource = await rag_service.refresh_resource(project_id, resource_id)
+        resource = await rag_service.refresh_resource(db, project_id, resource_id)
         return RefreshResponse(
             success=True,
             message="Resource refreshed successfully",
@@ -184,14 +231,15 @@ async def refresh_resource(project_id: str, resource_id: str):
 # ============ Chat Endpoints ============
 
 @app.post("/api/projects/{project_id}/chat", response_model=ChatResponse)
-async def chat(project_id: str, request: ChatRequest):
+async def chat(project_id: str, request: ChatRequest, db: Session = Depends(get_db)):
     """Chat with resources in a project."""
-    project = rag_service.get_project(project_id)
+    project = await run_in_threadpool(rag_service.get_project, db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
     try:
         result = await rag_service.chat(
+            db=db,
             project_id=project_id,
             message=request.message,
             resource_ids=request.resource_ids,
@@ -205,24 +253,59 @@ async def chat(project_id: str, request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
 
+def _sse_response(chunks) -> StreamingResponse:
+    """Wrap chat_stream chunks as a text/event-stream response."""
+    async def events():
+        try:
+            async for chunk in chunks:
+                yield f"data: {orjson.dumps(chunk).decode()}\n\n"
+        except Exception as e:
+            yield f"data: {orjson.dumps({'error': f'Chat failed: {str(e)}'}).decode()}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/api/projects/{project_id}/chat/stream")
+async def chat_stream(project_id: str, request: ChatRequest, db: Session = Depends(get_db)):
+    """Stream a chat answer as Server-Sent Events."""
+    project = await run_in_threadpool(rag_service.get_project, db, project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    # Retrieve before streaming: the db session is closed once the response starts
+    try:
+        inputs, sources = await rag_service.prepare_chat(
+            db=db,
+            project_id=project_id,
+            message=request.message,
+            resource_ids=request.resource_ids,
+            conversation_history=request.conversation_history
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+    
+    return _sse_response(rag_service.chat_stream(inputs, sources))
+
+
 # ============ Share Endpoints ============
 
 @app.post("/api/projects/{project_id}/share", response_model=ShareResponse, status_code=status.HTTP_201_CREATED)
-async def create_share(project_id: str, share: ShareCreate):
+def create_share(project_id: str, share: ShareCreate, db: Session = Depends(get_db)):
     """Create a share link for a project."""
     try:
         session = rag_service.create_share_session(
+            db=db,
             project_id=project_id,
             name=share.name
         )
-        project = rag_service.get_project(project_id)
-        resources = rag_service.get_share_session_resources(session.id)
+        project = rag_service.get_project(db, project_id)
+        stats = rag_service.get_project_stats(db, project_id)
         return ShareResponse(
             id=session.id,
             name=session.name,
             share_url=f"/s/{session.id}",
             project_name=project.name if project else "",
-            resource_count=len(resources),
+            resource_count=stats["ready"],
             created_at=session.created_at
         )
     except ValueError as e:
@@ -230,32 +313,27 @@ async def create_share(project_id: str, share: ShareCreate):
 
 
 @app.get("/api/projects/{project_id}/share", response_model=List[ShareResponse])
-async def list_shares(project_id: str):
+def list_shares(project_id: str, db: Session = Depends(get_db)):
     """List all share sessions for a project."""
-    sessions = rag_service.get_project_share_sessions(project_id)
-    project = rag_service.get_project(project_id)
-    return [
-        ShareResponse(
-            id=s.id,
-            name=s.name,
-            share_url=f"/s/{s.id}",
-            project_name=project.name if project else "",
-            resource_count=len(rag_service.get_share_session_resources(s.id)),
-            created_at=s.created_at
-        )
-        for s in sessions
-    ]
+    return rag_service.get_project_shares(db, project_id)
 
 
 @app.get("/api/share/{share_id}")
-async def get_share(share_id: str):
+def get_share(share_id: str, request: Request, response: Response, db: Session = Depends(get_db)):
     """Get share session info for public access."""
-    session = rag_service.get_share_session(share_id)
+    session = rag_service.get_share_session(db, share_id)
     if not session:
         raise HTTPException(status_code=404, detail="Share link not found")
     
-    project = rag_service.get_project(session.project_id)
-    resources = rag_service.get_share_session_resources(share_id)
+    project = rag_service.get_project(db, session.project_id)
+    resources = rag_service.get_share_session_resources(db, share_id)
+    
+    if _not_modified(
+        request, response,
+        session.id, session.name, project.name if project else "",
+        [(r.id, r.updated_at) for r in resources]
+    ):
+        return _not_modified_response(response)
     
     return {
         "id": session.id,
@@ -271,23 +349,24 @@ async def get_share(share_id: str):
 
 
 @app.delete("/api/share/{share_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_share(share_id: str):
+def delete_share(share_id: str, db: Session = Depends(get_db)):
     """Delete a share session."""
-    success = rag_service.delete_share_session(share_id)
+    success = rag_service.delete_share_session(db, share_id)
     if not success:
         raise HTTPException(status_code=404, detail="Share link not found")
     return None
 
 
 @app.post("/api/share/{share_id}/chat", response_model=ChatResponse)
-async def share_chat(share_id: str, request: ChatRequest):
+async def share_chat(share_id: str, request: ChatRequest, db: Session = Depends(get_db)):
     """Chat with shared project resources."""
-    session = rag_service.get_share_session(share_id)
+    session = await run_in_threadpool(rag_service.get_share_session, db, share_id)
     if not session:
         raise HTTPException(status_code=404, detail="Share link not found")
     
     try:
         result = await rag_service.chat(
+            db=db,
             project_id=session.project_id,
             message=request.message,
             resource_ids=request.resource_ids,
@@ -301,6 +380,28 @@ async def share_chat(share_id: str, request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
 
+@app.post("/api/share/{share_id}/chat/stream")
+async def share_chat_stream(share_id: str, request: ChatRequest, db: Session = Depends(get_db)):
+    """Stream a chat answer for shared project resources as Server-Sent Events."""
+    session = await run_in_threadpool(rag_service.get_share_session, db, share_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Share link not found")
+    
+    # Retrieve before streaming: the db session is closed once the response starts
+    try:
+        inputs, sources = await rag_service.prepare_chat(
+            db=db,
+            project_id=session.project_id,
+            message=request.message,
+            resource_ids=request.resource_ids,
+            conversation_history=request.conversation_history
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+    
+    return _sse_response(rag_service.chat_stream(inputs, sources))
+
+
 if __name__ == "__main__":
     import uvicorn
     settings = get_settings()
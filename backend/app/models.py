@@ -1,5 +1,5 @@
-from pydantic import BaseModel, HttpUrl
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field, HttpUrl, field_validator
+from typing import Optional, List, Literal
 from datetime import datetime
 from enum import Enum
 
@@ -18,6 +18,8 @@ class ProjectCreate(BaseModel):
 
 
 class Project(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     id: str
     name: str
     description: Optional[str] = None
@@ -25,11 +27,6 @@ class Project(BaseModel):
     updated_at: datetime
 
 
-class ProjectList(BaseModel):
-    projects: List[Project]
-    total: int
-
-
 class ProjectWithStats(Project):
     resource_count: int = 0
     ready_resource_count: int = 0
@@ -37,11 +34,18 @@ class ProjectWithStats(Project):
 
 # Resource models
 class ResourceCreate(BaseModel):
-    url: str
+    url: HttpUrl
     name: Optional[str] = None
 
 
+class ResourceBulkCreate(BaseModel):
+    # Each entry is scraped and embedded within the request, so keep batches bounded
+    resources: List[ResourceCreate] = Field(max_length=50)
+
+
 class Resource(BaseModel):
+    model_config = ConfigDict(frozen=True)
+    
     id: str
     project_id: str
     url: str
@@ -59,8 +63,13 @@ class ResourceList(BaseModel):
 
 
 # Chat models
+MAX_CONVERSATION_HISTORY = 20
+
+
 class ChatMessage(BaseModel):
-    role: str  # "user" or "assistant"
+    model_config = ConfigDict(frozen=True)
+    
+    role: Literal["user", "assistant"]
     content: str
 
 
@@ -68,11 +77,23 @@ class ChatRequest(BaseModel):
     message: str
     resource_ids: Optional[List[str]] = None  # If None, use all resources in project
     conversation_history: Optional[List[ChatMessage]] = []
+    
+    @field_validator("conversation_history", mode="before")
+    @classmethod
+    def cap_history(cls, v):
+        """Keep only the most recent messages before validating them."""
+        return v[-MAX_CONVERSATION_HISTORY:] if v else []
+
+
+class SourceChunk(BaseModel):
+    url: str
+    content: str  # Truncated preview of the chunk
+    score: float
 
 
 class ChatResponse(BaseModel):
     answer: str
-    sources: List[dict]  # Contains source chunks with metadata
+    sources: List[SourceChunk]
 
 
 class RefreshRequest(BaseModel):
@@ -1,19 +1,107 @@
+import asyncio
+import hashlib
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from functools import partial
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator
+
+import chromadb
+import numpy as np
+import tiktoken
+import zstandard
+from cachetools import TTLCache
+from sqlalchemy import func, case, exists, select
+from sqlalchemy.orm import Session
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from langchain.schema import Document
+from langchain_core.documents import Document
 
 from app.config import get_settings
-from app.models import Project, Resource, ResourceStatus, ChatMessage, ShareSession
-from app.database import SessionLocal, ProjectDB, ResourceDB, ShareSessionDB, ResourceStatusEnum, init_db
+from app.models import Project, ProjectWithStats, Resource, ResourceStatus, ChatMessage, ShareSession, ShareResponse
+from app.database import ProjectDB, ResourceDB, ShareSessionDB, ChunkDB, ResourceStatusEnum, init_db
+from app.chunking import RecursiveTextSplitter
+from app.embedding_cache import EmbeddingCache
 from app.scraper import scraper
+from app.semantic_cache import SemanticCache
+
+
+# Project rows change rarely; share endpoints look them up on every request
+_project_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
+_project_cache_lock = threading.Lock()
+# Advanced by every project write, so a fill that read the row before the write is dropped
+_project_cache_generation = 0
+
+NO_RESOURCES_ANSWER = "I don't have any resources to search. Please add some URLs first."
+
+COLLECTION_NAME = "refbook"
+
+# HNSW parameters for new collections; Chroma fixes them when the index is created
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 128
+}
+
+# Chroma stores this much of each chunk; the full text lives compressed in the chunks table
+CHUNK_EXCERPT_CHARS = 400
+CHUNK_COMPRESSION_LEVEL = 6
+
+# Filtered searches over at most this many chunks skip HNSW and compare every vector directly
+EXACT_SEARCH_MAX_CHUNKS = 200
+
+# Retrieved chunks sharing more than this fraction of word 5-grams count as duplicates
+NEAR_DUPLICATE_JACCARD = 0.7
+
+# Shortest repeat accepted when joining chunks stored without their offsets
+MIN_GUESSED_OVERLAP = 20
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    """Return the set of word n-grams in text."""
+    words = text.split()
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def _jaccard(a: set, b: set) -> float:
+    """Jaccard similarity of two sets."""
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def _join_overlapping(first: str, second: str, overlap: Optional[int], max_overlap: int) -> str:
+    """Join two consecutive chunks, dropping the text the splitter repeated between them.
+    
+    overlap is the repeated length when both chunks' offsets are known. Chunks stored
+    without offsets fall back to searching for the repeat, which must then span whole
+    words and be at least MIN_GUESSED_OVERLAP characters long.
+    """
+    if overlap is not None:
+        # A negative overlap is the whitespace stripped from between the chunks
+        if overlap >= 0 and first.endswith(second[:overlap]):
+            return first + second[overlap:]
+        return f"{first} {second}"
+    for size in range(min(max_overlap, len(first), len(second)), MIN_GUESSED_OVERLAP - 1, -1):
+        if (
+            first.endswith(second[:size])
+            and (size == len(first) or first[-size - 1].isspace())
+            and (size == len(second) or second[size].isspace())
+        ):
+            return first + second[size:]
+    return f"{first} {second}"
+
+
+def _forget_project(project_id: str):
+    """Drop a project from the cache after a committed write."""
+    global _project_cache_generation
+    with _project_cache_lock:
+        _project_cache.pop(project_id, None)
+        _project_cache_generation += 1
 
 
 class RAGService:
@@ -23,38 +111,57 @@ class RAGService:
         self.settings = get_settings()
         self._embeddings = None
         self._vectorstore = None
+        self._vector_space = "l2"
         self._llm = None
+        self._chat_chain = None
+        self._encoding = None
+        self._embedding_cache = None
+        self._encode_pool = None
+        # The multi-GPU pool has one shared input/output queue, so only one caller may use it at a time
+        self._encode_pool_lock = threading.Lock()
+        
+        # Embedding is CPU/GPU-bound; give it its own threads so it can't starve the default pool
+        self._embed_executor = ThreadPoolExecutor(
+            max_workers=self.settings.embedding_workers,
+            thread_name_prefix="embed"
+        )
+        
+        # Plain copies of settings read on every chat request
+        self.top_k = self.settings.top_k
+        
+        # Near-duplicate queries reuse retrieved sources and, without history, whole answers
+        self._retrieval_cache = SemanticCache(
+            threshold=self.settings.semantic_cache_threshold,
+            ttl=self.settings.semantic_cache_ttl,
+            maxsize=self.settings.semantic_cache_size
+        )
+        self._answer_cache = SemanticCache(
+            threshold=self.settings.semantic_cache_threshold,
+            ttl=self.settings.semantic_answer_cache_ttl,
+            maxsize=self.settings.semantic_cache_size
+        )
         
         # Initialize database
         init_db()
         
         # Text splitter for chunking
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.text_splitter = RecursiveTextSplitter(
             chunk_size=self.settings.chunk_size,
             chunk_overlap=self.settings.chunk_overlap,
-            length_function=len,
             separators=["\n\n", "\n", ". ", " ", ""]
         )
         
-        # System prompt for RAG
+        # System prompt for RAG; kept free of variables so every request shares it as a prefix
         self.system_prompt = """You are a helpful assistant that answers questions based ONLY on the provided context.
 If the context doesn't contain enough information to answer the question, say "I don't have enough information in the provided resources to answer this question."
 Always cite which source(s) you used to answer the question.
-
-Context:
-{context}
-
-Previous conversation:
-{history}
 """
     
-    def _get_db(self):
-        """Get a database session."""
-        return SessionLocal()
+    # DB rows are already typed by their columns, so the converters skip Pydantic validation
     
     def _db_to_project(self, db_project: ProjectDB) -> Project:
         """Convert DB model to Pydantic model."""
-        return Project(
+        return Project.model_construct(
             id=db_project.id,
             name=db_project.name,
             description=db_project.description,
@@ -64,7 +171,7 @@ Previous conversation:
     
     def _db_to_resource(self, db_resource: ResourceDB) -> Resource:
         """Convert DB model to Pydantic model."""
-        return Resource(
+        return Resource.model_construct(
             id=db_resource.id,
             project_id=db_resource.project_id,
             url=db_resource.url,
@@ -78,7 +185,7 @@ Previous conversation:
     
     def _db_to_share_session(self, db_session: ShareSessionDB) -> ShareSession:
         """Convert DB model to Pydantic model."""
-        return ShareSession(
+        return ShareSession.model_construct(
             id=db_session.id,
             project_id=db_session.project_id,
             name=db_session.name,
@@ -89,27 +196,137 @@ Previous conversation:
     def embeddings(self):
         """Lazy load embeddings model."""
         if self._embeddings is None:
+            import torch
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
             self._embeddings = HuggingFaceEmbeddings(
                 model_name=self.settings.embedding_model,
-                model_kwargs={'device': 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
+                model_kwargs={'device': device},
+                encode_kwargs={
+                    'batch_size': self.settings.embedding_batch_size,
+                    'normalize_embeddings': True
+                }
             )
+            self._optimize_encoder(self._embeddings.client)
+            if torch.cuda.device_count() > 1:
+                self._encode_pool = self._embeddings.client.start_multi_process_pool()
         return self._embeddings
     
+    @property
+    def embedding_cache(self) -> EmbeddingCache:
+        """Lazy open the on-disk embedding cache."""
+        if self._embedding_cache is None:
+            self._embedding_cache = EmbeddingCache(
+                self.settings.embedding_cache_path,
+                self.settings.embedding_model
+            )
+        return self._embedding_cache
+    
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, reusing cached vectors and encoding only texts not seen before."""
+        vectors = self.embedding_cache.get_many(texts)
+        misses = [i for i, vector in enumerate(vectors) if vector is None]
+        if misses:
+            miss_texts = [texts[i] for i in misses]
+            encoded = self._encode_documents(miss_texts)
+            self.embedding_cache.put_many(miss_texts, encoded)
+            for i, vector in zip(misses, encoded):
+                vectors[i] = vector
+        return vectors
+    
+    def _encode_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, spreading the work over all GPUs when more than one is available."""
+        embeddings = self.embeddings
+        if self._encode_pool is None:
+            return embeddings.embed_documents(texts)
+        
+        with self._encode_pool_lock:
+            vectors = embeddings.client.encode_multi_process(
+                texts, self._encode_pool, batch_size=self.settings.embedding_batch_size
+            )
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.tolist()
+    
+    async def _run_embedding(self, func, *args, **kwargs):
+        """Run an embedding-bound call on the embedding executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._embed_executor, partial(func, *args, **kwargs))
+    
+    def shutdown(self):
+        """Release resources held by the service."""
+        if self._encode_pool is not None:
+            self._embeddings.client.stop_multi_process_pool(self._encode_pool)
+            self._encode_pool = None
+        self._embed_executor.shutdown(wait=False)
+        if self._embedding_cache is not None:
+            self._embedding_cache.close()
+            self._embedding_cache = None
+    
+    def _optimize_encoder(self, model):
+        """Run the encoder in FP16 on GPU, or int8-quantized on CPU when enabled."""
+        import torch
+        if model.device.type == "cuda":
+            model.half()
+        elif self.settings.embedding_quantize:
+            torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    
     @property
     def vectorstore(self):
         """Lazy load or create vector store."""
         if self._vectorstore is None:
-            persist_dir = self.settings.chroma_persist_directory
-            os.makedirs(persist_dir, exist_ok=True)
+            if self.settings.chroma_mode == "server":
+                # A standalone Chroma server keeps index writes out of the API process
+                client = chromadb.HttpClient(
+                    host=self.settings.chroma_host,
+                    port=self.settings.chroma_port
+                )
+            else:
+                persist_dir = self.settings.chroma_persist_directory
+                os.makedirs(persist_dir, exist_ok=True)
+                client = chromadb.PersistentClient(path=persist_dir)
             
             self._vectorstore = Chroma(
-                collection_name="refbook",
+                collection_name=COLLECTION_NAME,
                 embedding_function=self.embeddings,
-                persist_directory=persist_dir
+                client=client,
+                collection_metadata=self._new_collection_metadata(client)
             )
+            # Collections created before HNSW tuning still use Chroma's default (squared) L2
+            metadata = self._vectorstore._collection.metadata or {}
+            self._vector_space = metadata.get("hnsw:space", "l2")
+            if self.settings.chroma_mode != "server":
+                self._tune_chroma_sqlite()
         return self._vectorstore
     
+    def _new_collection_metadata(self, client) -> Optional[Dict[str, Any]]:
+        """HNSW metadata when the collection is about to be created, None for an existing one.
+        
+        Passing metadata for an existing collection would overwrite its stored parameters
+        without rebuilding the index they describe.
+        """
+        if any(c.name == COLLECTION_NAME for c in client.list_collections()):
+            return None
+        return HNSW_METADATA
+    
+    def _tune_chroma_sqlite(self):
+        """Apply write-friendly pragmas to Chroma's embedded SQLite database."""
+        try:
+            pool = self._vectorstore._client._server._sysdb._conn_pool
+            conn = pool.connect()
+        except Exception:
+            # Internals differ across chromadb versions and client modes
+            return
+        try:
+            # journal_mode persists in the database file; the rest apply to this thread's connection
+            for pragma in (
+                "journal_mode=WAL",
+                "synchronous=NORMAL",
+                "temp_store=MEMORY",
+                "mmap_size=30000000000",
+            ):
+                conn.execute(f"PRAGMA {pragma}")
+        finally:
+            pool.return_to_pool(conn)
+    
     @property
     def llm(self):
         """Lazy load LLM."""
@@ -121,378 +338,713 @@ Previous conversation:
             )
         return self._llm
     
+    @property
+    def encoding(self):
+        """Lazy load the tokenizer matching the LLM."""
+        if self._encoding is None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(self.settings.llm_model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+        return self._encoding
+    
+    def warmup(self):
+        """Run dummy forward passes and a vector query so the first request is not slowed down."""
+        for _ in range(3):
+            self.embeddings.embed_query("warmup")
+        
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+            torch.cuda.empty_cache()
+        
+        # tiktoken fetches its BPE file on first use
+        self.encoding.encode("warmup")
+        
+        # Touch the HNSW index so its pages are loaded before the first query
+        try:
+            self.vectorstore.similarity_search("warmup", k=1)
+        except Exception:
+            pass
+    
     # ============ Project Methods ============
     
-    def create_project(self, name: str, description: Optional[str] = None) -> Project:
+    def create_project(self, db: Session, name: str, description: Optional[str] = None) -> Project:
         """Create a new project."""
-        db = self._get_db()
-        try:
-            db_project = ProjectDB(
-                id=str(uuid.uuid4()),
-                name=name,
-                description=description
-            )
-            db.add(db_project)
-            db.commit()
-            db.refresh(db_project)
-            return self._db_to_project(db_project)
-        finally:
-            db.close()
+        db_project = ProjectDB(
+            id=str(uuid.uuid4()),
+            name=name,
+            description=description
+        )
+        db.add(db_project)
+        db.commit()
+        return self._db_to_project(db_project)
     
-    def get_project(self, project_id: str) -> Optional[Project]:
+    def get_project(self, db: Session, project_id: str) -> Optional[Project]:
         """Get a project by ID."""
-        db = self._get_db()
-        try:
-            db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
-            return self._db_to_project(db_project) if db_project else None
-        finally:
-            db.close()
+        with _project_cache_lock:
+            project = _project_cache.get(project_id)
+            generation = _project_cache_generation
+        if project is not None:
+            return project
+        db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
+        if db_project is None:
+            # Misses aren't cached, so a project created later is seen right away
+            return None
+        project = self._db_to_project(db_project)
+        with _project_cache_lock:
+            if generation == _project_cache_generation:
+                _project_cache[project_id] = project
+        return project
     
-    def get_all_projects(self) -> List[Project]:
-        """Get all projects."""
-        db = self._get_db()
-        try:
-            db_projects = db.query(ProjectDB).order_by(ProjectDB.created_at.desc()).all()
-            return [self._db_to_project(p) for p in db_projects]
-        finally:
-            db.close()
+    def _query_projects_with_stats(self, db):
+        """Query projects joined with their total and ready resource counts."""
+        return db.query(
+            ProjectDB,
+            func.count(ResourceDB.id).label("total"),
+            func.sum(case((ResourceDB.status == ResourceStatusEnum.READY, 1), else_=0)).label("ready")
+        ).outerjoin(ResourceDB).group_by(ProjectDB.id)
+    
+    def _row_to_project_with_stats(self, row) -> ProjectWithStats:
+        """Convert a (project, total, ready) row to a Pydantic model."""
+        db_project, total, ready = row
+        return ProjectWithStats.model_construct(
+            **self._db_to_project(db_project).__dict__,
+            resource_count=total,
+            ready_resource_count=ready or 0
+        )
+    
+    def get_project_with_stats(self, db: Session, project_id: str) -> Optional[ProjectWithStats]:
+        """Get a project with its resource counts in a single query."""
+        row = self._query_projects_with_stats(db).filter(ProjectDB.id == project_id).first()
+        return self._row_to_project_with_stats(row) if row else None
+    
+    def get_all_projects_with_stats(self, db: Session) -> List[ProjectWithStats]:
+        """Get all projects with resource counts in a single query."""
+        rows = self._query_projects_with_stats(db).order_by(ProjectDB.created_at.desc()).all()
+        return [self._row_to_project_with_stats(row) for row in rows]
     
-    def update_project(self, project_id: str, name: Optional[str] = None, description: Optional[str] = None) -> Optional[Project]:
+    def update_project(self, db: Session, project_id: str, name: Optional[str] = None, description: Optional[str] = None) -> Optional[Project]:
         """Update a project."""
-        db = self._get_db()
-        try:
-            db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
-            if not db_project:
-                return None
-            
-            if name is not None:
-                db_project.name = name
-            if description is not None:
-                db_project.description = description
-            db_project.updated_at = datetime.utcnow()
-            
-            db.commit()
-            db.refresh(db_project)
-            return self._db_to_project(db_project)
-        finally:
-            db.close()
+        db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
+        if not db_project:
+            return None
+        
+        if name is not None:
+            db_project.name = name
+        if description is not None:
+            db_project.description = description
+        db_project.updated_at = datetime.utcnow()
+        
+        db.commit()
+        _forget_project(project_id)
+        return self._db_to_project(db_project)
     
-    async def delete_project(self, project_id: str) -> bool:
+    async def delete_project(self, db: Session, project_id: str) -> bool:
         """Delete a project and all its resources."""
-        db = self._get_db()
-        try:
-            db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
-            if not db_project:
-                return False
-            
-            # Delete vectors for all resources in this project
-            db_resources = db.query(ResourceDB).filter(ResourceDB.project_id == project_id).all()
-            for resource in db_resources:
-                await self._delete_resource_vectors(resource.id)
-            
-            # Delete project (cascade will delete resources and share sessions)
-            db.delete(db_project)
-            db.commit()
-            return True
-        finally:
-            db.close()
+        db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
+        if not db_project:
+            return False
+        
+        # Delete vectors for all resources in this project
+        db_resources = db.query(ResourceDB).filter(ResourceDB.project_id == project_id).all()
+        for resource in db_resources:
+            await self._delete_resource_vectors(resource.id)
+        self._delete_chunk_texts(db, [resource.id for resource in db_resources])
+        
+        # Delete project (cascade will delete resources and share sessions)
+        db.delete(db_project)
+        db.commit()
+        _forget_project(project_id)
+        self._invalidate_chat_cache(project_id)
+        return True
     
-    def get_project_stats(self, project_id: str) -> Dict[str, int]:
+    def _status_counts(self, db, project_id: str) -> Dict[str, int]:
+        """Count a project's resources per status with a single GROUP BY."""
+        rows = db.query(ResourceDB.status, func.count()).filter(
+            ResourceDB.project_id == project_id
+        ).group_by(ResourceDB.status).all()
+        counts = dict(rows)
+        return {
+            "total": sum(counts.values()),
+            "ready": counts.get(ResourceStatusEnum.READY, 0),
+            "processing": counts.get(ResourceStatusEnum.PROCESSING, 0),
+            "error": counts.get(ResourceStatusEnum.ERROR, 0)
+        }
+    
+    def get_project_stats(self, db: Session, project_id: str) -> Dict[str, int]:
         """Get resource stats for a project."""
-        db = self._get_db()
-        try:
-            resources = db.query(ResourceDB).filter(ResourceDB.project_id == project_id).all()
-            return {
-                "total": len(resources),
-                "ready": len([r for r in resources if r.status == ResourceStatusEnum.READY]),
-                "processing": len([r for r in resources if r.status == ResourceStatusEnum.PROCESSING]),
-                "error": len([r for r in resources if r.status == ResourceStatusEnum.ERROR])
-            }
-        finally:
-            db.close()
+        return self._status_counts(db, project_id)
     
     # ============ Resource Methods ============
     
-    async def add_resource(self, project_id: str, url: str, name: Optional[str] = None) -> Resource:
+    async def add_resource(self, db: Session, project_id: str, url: str, name: Optional[str] = None) -> Resource:
         """Add a new resource to a project."""
-        db = self._get_db()
+        # Check project exists
+        db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
+        if not db_project:
+            raise ValueError(f"Project {project_id} not found")
+        
+        resource_id = str(uuid.uuid4())
+        db_resource = ResourceDB(
+            id=resource_id,
+            project_id=project_id,
+            url=url,
+            name=name or url,
+            status=ResourceStatusEnum.PROCESSING
+        )
+        db.add(db_resource)
+        db.commit()
+        
+        # Process in background
         try:
-            # Check project exists
-            db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
-            if not db_project:
-                raise ValueError(f"Project {project_id} not found")
+            title, content = await scraper.scrape_url(url)
             
-            resource_id = str(uuid.uuid4())
-            db_resource = ResourceDB(
-                id=resource_id,
+            if name is None:
+                db_resource.name = title
+            
+            chunk_count = await self._process_content(db, project_id, resource_id, url, content)
+            
+            db_resource.chunk_count = chunk_count
+            db_resource.status = ResourceStatusEnum.READY
+            db_resource.updated_at = datetime.utcnow()
+            
+        except Exception as e:
+            db_resource.status = ResourceStatusEnum.ERROR
+            db_resource.error_message = str(e)
+            db_resource.updated_at = datetime.utcnow()
+        
+        db.commit()
+        # Only now is the resource READY to retrieval, so answers cached before this are stale
+        self._invalidate_chat_cache(project_id)
+        return self._db_to_resource(db_resource)
+    
+    async def add_resources(self, db: Session, project_id: str, items: List[Tuple[str, Optional[str]]]) -> List[Resource]:
+        """Add several (url, name) resources to a project, scraping concurrently and embedding in shared batches."""
+        db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
+        if not db_project:
+            raise ValueError(f"Project {project_id} not found")
+        
+        db_resources = [
+            ResourceDB(
+                id=str(uuid.uuid4()),
                 project_id=project_id,
                 url=url,
                 name=name or url,
                 status=ResourceStatusEnum.PROCESSING
             )
-            db.add(db_resource)
-            db.commit()
-            db.refresh(db_resource)
-            
-            # Process in background
-            try:
-                title, content = await scraper.scrape_url(url)
-                
-                if name is None:
-                    db_resource.name = title
-                
-                chunk_count = await self._process_content(project_id, resource_id, url, content)
-                
-                db_resource.chunk_count = chunk_count
-                db_resource.status = ResourceStatusEnum.READY
-                db_resource.updated_at = datetime.utcnow()
-                
-            except Exception as e:
+            for url, name in items
+        ]
+        db.add_all(db_resources)
+        db.commit()
+        
+        scraped = await scraper.scrape_urls(
+            [r.url for r in db_resources],
+            concurrency=self.settings.scrape_concurrency
+        )
+        
+        ids, documents, metadatas = [], [], []
+        processed = []
+        for db_resource, (_, name), result in zip(db_resources, items, scraped):
+            if isinstance(result, BaseException):
                 db_resource.status = ResourceStatusEnum.ERROR
-                db_resource.error_message = str(e)
+                db_resource.error_message = str(result)
                 db_resource.updated_at = datetime.utcnow()
+                continue
             
-            db.commit()
-            db.refresh(db_resource)
-            return self._db_to_resource(db_resource)
-        finally:
-            db.close()
-    
-    async def _process_content(self, project_id: str, resource_id: str, url: str, content: str) -> int:
-        """Process content and add to vector store."""
-        chunks = self.text_splitter.split_text(content)
-        
-        documents = [
-            Document(
-                page_content=chunk,
-                metadata={
-                    "project_id": project_id,
-                    "resource_id": resource_id,
-                    "url": url,
-                    "chunk_index": i
-                }
+            title, content = result
+            if name is None:
+                db_resource.name = title
+            chunk_ids, chunk_documents, chunk_metadatas = self._chunk_payload(
+                project_id, db_resource.id, db_resource.url, content
             )
-            for i, chunk in enumerate(chunks)
-        ]
+            ids += chunk_ids
+            documents += chunk_documents
+            metadatas += chunk_metadatas
+            db_resource.chunk_count = len(chunk_ids)
+            processed.append(db_resource)
+        
+        try:
+            await self._run_embedding(self._write_chunks, ids, documents, metadatas)
+            self._store_chunk_texts(db, ids, documents, metadatas)
+            status, error = ResourceStatusEnum.READY, None
+        except Exception as e:
+            status, error = ResourceStatusEnum.ERROR, str(e)
+            # Don't leave behind the batches written before the failure
+            if ids:
+                try:
+                    await asyncio.to_thread(self.vectorstore._collection.delete, ids=ids)
+                except Exception:
+                    pass
+        for db_resource in processed:
+            db_resource.status = status
+            db_resource.error_message = error
+            db_resource.updated_at = datetime.utcnow()
+        
+        db.commit()
+        self._invalidate_chat_cache(project_id)
+        return [self._db_to_resource(r) for r in db_resources]
+    
+    def _chunk_payload(
+        self,
+        project_id: str,
+        resource_id: str,
+        url: str,
+        content: str
+    ) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+        """Split content into chunks and build their (ids, documents, metadatas).
+        
+        Ids are derived from the chunk text, so unchanged chunks keep their id across refreshes.
+        """
+        ids, documents, metadatas = [], [], []
+        seen = set()
+        # chunk_index is the splitter position, so a skipped duplicate leaves a gap in the indexes
+        for chunk_index, (start_index, chunk) in enumerate(self.text_splitter.split_text_with_offsets(content)):
+            chunk_id = f"{resource_id}:{hashlib.sha1(chunk.encode()).hexdigest()[:16]}"
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            ids.append(chunk_id)
+            documents.append(chunk)
+            metadatas.append({
+                "project_id": project_id,
+                "resource_id": resource_id,
+                "url": url,
+                "chunk_index": chunk_index,
+                "start_index": start_index
+            })
+        return ids, documents, metadatas
+    
+    def _write_chunks(
+        self,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """Embed and write chunks to the vector store in batches, storing only an excerpt of each."""
+        collection = self.vectorstore._collection
+        batch_size = self.settings.chunk_batch_size
+        
+        for start in range(0, len(ids), batch_size):
+            batch = documents[start:start + batch_size]
+            collection.add(
+                ids=ids[start:start + batch_size],
+                documents=[document[:CHUNK_EXCERPT_CHARS] for document in batch],
+                metadatas=metadatas[start:start + batch_size],
+                embeddings=self._embed_documents(batch)
+            )
+    
+    def _store_chunk_texts(
+        self,
+        db: Session,
+        ids: List[str],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]]
+    ):
+        """Add the compressed full text of chunks to the session, replacing rows with the same ids."""
+        if not ids:
+            return
+        db.query(ChunkDB).filter(ChunkDB.id.in_(ids)).delete(synchronize_session=False)
+        db.add_all([
+            ChunkDB(
+                id=chunk_id,
+                resource_id=metadata["resource_id"],
+                content=zstandard.compress(document.encode(), CHUNK_COMPRESSION_LEVEL)
+            )
+            for chunk_id, document, metadata in zip(ids, documents, metadatas)
+        ])
+    
+    def _delete_chunk_texts(self, db: Session, resource_ids: List[str]):
+        """Delete the stored chunk text of resources."""
+        if resource_ids:
+            db.query(ChunkDB).filter(ChunkDB.resource_id.in_(resource_ids)).delete(synchronize_session=False)
+    
+    def _load_chunk_texts(self, db: Session, ids: List[str]) -> Dict[str, str]:
+        """Return the full text of the given chunks that have it stored."""
+        rows = db.query(ChunkDB.id, ChunkDB.content).filter(ChunkDB.id.in_(ids)).all()
+        return {row.id: zstandard.decompress(row.content).decode() for row in rows}
+    
+    async def _process_content(self, db: Session, project_id: str, resource_id: str, url: str, content: str) -> int:
+        """Sync a resource's chunks into the vector store, embedding only chunks not already stored."""
+        ids, documents, metadatas = self._chunk_payload(project_id, resource_id, url, content)
+        collection = self.vectorstore._collection
+        stored = await asyncio.to_thread(collection.get, where={"resource_id": resource_id}, include=[])
+        existing = set(stored["ids"])
         
-        if documents:
-            self.vectorstore.add_documents(documents)
+        new = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+        await self._run_embedding(
+            self._write_chunks,
+            [ids[i] for i in new],
+            [documents[i] for i in new],
+            [metadatas[i] for i in new]
+        )
+        self._store_chunk_texts(
+            db,
+            [ids[i] for i in new],
+            [documents[i] for i in new],
+            [metadatas[i] for i in new]
+        )
+        
+        # Unchanged chunks may have moved; update their positions without re-embedding
+        kept = [i for i, chunk_id in enumerate(ids) if chunk_id in existing]
+        if kept:
+            await asyncio.to_thread(
+                collection.update,
+                ids=[ids[i] for i in kept],
+                metadatas=[metadatas[i] for i in kept]
+            )
+        
+        stale = existing.difference(ids)
+        if stale:
+            await asyncio.to_thread(collection.delete, ids=list(stale))
+            db.query(ChunkDB).filter(ChunkDB.id.in_(stale)).delete(synchronize_session=False)
         
-        return len(documents)
+        return len(ids)
     
-    async def refresh_resource(self, project_id: str, resource_id: str) -> Resource:
+    async def refresh_resource(self, db: Session, project_id: str, resource_id: str) -> Resource:
         """Refresh a resource by re-scraping and updating vectors."""
-        db = self._get_db()
+        db_resource = db.query(ResourceDB).filter(
+            ResourceDB.id == resource_id,
+            ResourceDB.project_id == project_id
+        ).first()
+        
+        if not db_resource:
+            raise ValueError(f"Resource {resource_id} not found")
+        
+        db_resource.status = ResourceStatusEnum.PROCESSING
+        db_resource.updated_at = datetime.utcnow()
+        db.commit()
+        
         try:
-            db_resource = db.query(ResourceDB).filter(
-                ResourceDB.id == resource_id,
-                ResourceDB.project_id == project_id
-            ).first()
-            
-            if not db_resource:
-                raise ValueError(f"Resource {resource_id} not found")
+            # Refreshing must see the current page; unchanged pages come back as a cheap 304
+            title, content = await scraper.scrape_url(db_resource.url, max_age=0)
+            chunk_count = await self._process_content(db, project_id, resource_id, db_resource.url, content)
             
-            db_resource.status = ResourceStatusEnum.PROCESSING
+            db_resource.chunk_count = chunk_count
+            db_resource.status = ResourceStatusEnum.READY
+            db_resource.error_message = None
             db_resource.updated_at = datetime.utcnow()
-            db.commit()
             
-            try:
-                await self._delete_resource_vectors(resource_id)
-                title, content = await scraper.scrape_url(db_resource.url)
-                chunk_count = await self._process_content(project_id, resource_id, db_resource.url, content)
-                
-                db_resource.chunk_count = chunk_count
-                db_resource.status = ResourceStatusEnum.READY
-                db_resource.error_message = None
-                db_resource.updated_at = datetime.utcnow()
-                
-            except Exception as e:
-                db_resource.status = ResourceStatusEnum.ERROR
-                db_resource.error_message = str(e)
-                db_resource.updated_at = datetime.utcnow()
-            
-            db.commit()
-            db.refresh(db_resource)
-            return self._db_to_resource(db_resource)
-        finally:
-            db.close()
+        except Exception as e:
+            # Don't keep serving stale content for a resource that failed to refresh
+            await self._delete_resource_vectors(resource_id)
+            self._delete_chunk_texts(db, [resource_id])
+            db_resource.status = ResourceStatusEnum.ERROR
+            db_resource.error_message = str(e)
+            db_resource.updated_at = datetime.utcnow()
+        
+        db.commit()
+        self._invalidate_chat_cache(project_id)
+        return self._db_to_resource(db_resource)
     
     async def _delete_resource_vectors(self, resource_id: str):
         """Delete all vectors for a resource."""
         try:
-            results = self.vectorstore.get(where={"resource_id": resource_id})
+            results = await asyncio.to_thread(self.vectorstore.get, where={"resource_id": resource_id})
             if results and results.get("ids"):
-                self.vectorstore.delete(ids=results["ids"])
+                await asyncio.to_thread(self.vectorstore.delete, ids=results["ids"])
         except Exception:
             pass
     
-    async def delete_resource(self, project_id: str, resource_id: str) -> bool:
+    async def delete_resource(self, db: Session, project_id: str, resource_id: str) -> bool:
         """Delete a resource and its vectors."""
-        db = self._get_db()
-        try:
-            db_resource = db.query(ResourceDB).filter(
-                ResourceDB.id == resource_id,
-                ResourceDB.project_id == project_id
-            ).first()
-            
-            if not db_resource:
-                return False
-            
-            await self._delete_resource_vectors(resource_id)
-            db.delete(db_resource)
-            db.commit()
-            return True
-        finally:
-            db.close()
+        db_resource = db.query(ResourceDB).filter(
+            ResourceDB.id == resource_id,
+            ResourceDB.project_id == project_id
+        ).first()
+        
+        if not db_resource:
+            return False
+        
+        await self._delete_resource_vectors(resource_id)
+        self._delete_chunk_texts(db, [resource_id])
+        db.delete(db_resource)
+        db.commit()
+        self._invalidate_chat_cache(project_id)
+        return True
     
-    def get_resource(self, resource_id: str) -> Optional[Resource]:
+    def get_resource(self, db: Session, resource_id: str) -> Optional[Resource]:
         """Get a resource by ID."""
-        db = self._get_db()
-        try:
-            db_resource = db.query(ResourceDB).filter(ResourceDB.id == resource_id).first()
-            return self._db_to_resource(db_resource) if db_resource else None
-        finally:
-            db.close()
+        db_resource = db.query(ResourceDB).filter(ResourceDB.id == resource_id).first()
+        return self._db_to_resource(db_resource) if db_resource else None
     
-    def get_project_resources(self, project_id: str) -> List[Resource]:
+    def get_project_resources(self, db: Session, project_id: str) -> List[Resource]:
         """Get all resources for a project."""
-        db = self._get_db()
-        try:
-            db_resources = db.query(ResourceDB).filter(
-                ResourceDB.project_id == project_id
-            ).order_by(ResourceDB.created_at.desc()).all()
-            return [self._db_to_resource(r) for r in db_resources]
-        finally:
-            db.close()
+        db_resources = db.query(ResourceDB).filter(
+            ResourceDB.project_id == project_id
+        ).order_by(ResourceDB.created_at.desc()).all()
+        return [self._db_to_resource(r) for r in db_resources]
     
     # ============ Share Session Methods ============
     
-    def create_share_session(self, project_id: str, name: Optional[str] = None) -> ShareSession:
+    def create_share_session(self, db: Session, project_id: str, name: Optional[str] = None) -> ShareSession:
         """Create a share session for a project."""
-        db = self._get_db()
-        try:
-            db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
-            if not db_project:
-                raise ValueError(f"Project {project_id} not found")
-            
-            ready_count = db.query(ResourceDB).filter(
+        db_project = db.query(ProjectDB).filter(ProjectDB.id == project_id).first()
+        if not db_project:
+            raise ValueError(f"Project {project_id} not found")
+        
+        # EXISTS on the (project_id, status) index stops at the first ready resource
+        has_ready = db.query(
+            exists().where(
                 ResourceDB.project_id == project_id,
                 ResourceDB.status == ResourceStatusEnum.READY
-            ).count()
-            
-            if ready_count == 0:
-                raise ValueError("No ready resources to share")
-            
-            session_id = str(uuid.uuid4())[:8]
-            db_session = ShareSessionDB(
-                id=session_id,
-                project_id=project_id,
-                name=name or db_project.name
             )
-            db.add(db_session)
-            db.commit()
-            db.refresh(db_session)
-            return self._db_to_share_session(db_session)
-        finally:
-            db.close()
+        ).scalar()
+        if not has_ready:
+            raise ValueError("No ready resources to share")
+        
+        session_id = str(uuid.uuid4())[:8]
+        db_session = ShareSessionDB(
+            id=session_id,
+            project_id=project_id,
+            name=name or db_project.name
+        )
+        db.add(db_session)
+        db.commit()
+        return self._db_to_share_session(db_session)
     
-    def get_share_session(self, session_id: str) -> Optional[ShareSession]:
+    def get_share_session(self, db: Session, session_id: str) -> Optional[ShareSession]:
         """Get a share session by ID."""
-        db = self._get_db()
-        try:
-            db_session = db.query(ShareSessionDB).filter(ShareSessionDB.id == session_id).first()
-            return self._db_to_share_session(db_session) if db_session else None
-        finally:
-            db.close()
+        db_session = db.query(ShareSessionDB).filter(ShareSessionDB.id == session_id).first()
+        return self._db_to_share_session(db_session) if db_session else None
     
-    def get_share_session_resources(self, session_id: str) -> List[Resource]:
+    def get_share_session_resources(self, db: Session, session_id: str) -> List[Resource]:
         """Get resources for a share session."""
-        db = self._get_db()
-        try:
-            db_session = db.query(ShareSessionDB).filter(ShareSessionDB.id == session_id).first()
-            if not db_session:
-                return []
-            
-            db_resources = db.query(ResourceDB).filter(
-                ResourceDB.project_id == db_session.project_id,
-                ResourceDB.status == ResourceStatusEnum.READY
-            ).all()
-            return [self._db_to_resource(r) for r in db_resources]
-        finally:
-            db.close()
+        db_session = db.query(ShareSessionDB).filter(ShareSessionDB.id == session_id).first()
+        if not db_session:
+            return []
+        
+        db_resources = db.query(ResourceDB).filter(
+            ResourceDB.project_id == db_session.project_id,
+            ResourceDB.status == ResourceStatusEnum.READY
+        ).all()
+        return [self._db_to_resource(r) for r in db_resources]
     
-    def delete_share_session(self, session_id: str) -> bool:
+    def delete_share_session(self, db: Session, session_id: str) -> bool:
         """Delete a share session."""
-        db = self._get_db()
-        try:
-            db_session = db.query(ShareSessionDB).filter(ShareSessionDB.id == session_id).first()
-            if not db_session:
-                return False
-            db.delete(db_session)
-            db.commit()
-            return True
-        finally:
-            db.close()
+        db_session = db.query(ShareSessionDB).filter(ShareSessionDB.id == session_id).first()
+        if not db_session:
+            return False
+        db.delete(db_session)
+        db.commit()
+        return True
     
-    def get_project_share_sessions(self, project_id: str) -> List[ShareSession]:
+    def get_project_share_sessions(self, db: Session, project_id: str) -> List[ShareSession]:
         """Get all share sessions for a project."""
-        db = self._get_db()
-        try:
-            db_sessions = db.query(ShareSessionDB).filter(
-                ShareSessionDB.project_id == project_id
-            ).order_by(ShareSessionDB.created_at.desc()).all()
-            return [self._db_to_share_session(s) for s in db_sessions]
-        finally:
-            db.close()
+        db_sessions = db.query(ShareSessionDB).filter(
+            ShareSessionDB.project_id == project_id
+        ).order_by(ShareSessionDB.created_at.desc()).all()
+        return [self._db_to_share_session(s) for s in db_sessions]
+    
+    def get_project_shares(self, db: Session, project_id: str) -> List[ShareResponse]:
+        """Get all share sessions for a project with project name and ready resource count in one query."""
+        ready_count = select(func.count(ResourceDB.id)).where(
+            ResourceDB.project_id == ShareSessionDB.project_id,
+            ResourceDB.status == ResourceStatusEnum.READY
+        ).correlate(ShareSessionDB).scalar_subquery()
+        rows = db.query(
+            ShareSessionDB,
+            ProjectDB.name,
+            ready_count.label("resource_count")
+        ).join(ProjectDB, ProjectDB.id == ShareSessionDB.project_id).filter(
+            ShareSessionDB.project_id == project_id
+        ).order_by(ShareSessionDB.created_at.desc()).all()
+        return [
+            ShareResponse.model_construct(
+                id=s.id,
+                name=s.name,
+                share_url=f"/s/{s.id}",
+                project_name=project_name,
+                resource_count=resource_count,
+                created_at=s.created_at
+            )
+            for s, project_name, resource_count in rows
+        ]
     
     # ============ Chat Methods ============
     
-    async def chat(
+    def _chat_scope(self, project_id: str, resource_ids: Optional[List[str]]) -> Tuple[str, Optional[Tuple[str, ...]]]:
+        """Cache scope for a chat query: the project and the selected resources."""
+        return project_id, tuple(sorted(resource_ids)) if resource_ids else None
+    
+    def _invalidate_chat_cache(self, project_id: str):
+        """Forget cached sources and answers for a project after its resources change."""
+        self._retrieval_cache.invalidate(lambda scope: scope[0] == project_id)
+        self._answer_cache.invalidate(lambda scope: scope[0] == project_id)
+    
+    def _ready_chunks(self, db: Session, project_id: str, resource_ids: Optional[List[str]]) -> Tuple[List[str], int]:
+        """Return the ids of a project's ready resources (within resource_ids, if given) and their chunk total."""
+        query = db.query(ResourceDB.id, ResourceDB.chunk_count).filter(
+            ResourceDB.project_id == project_id,
+            ResourceDB.status == ResourceStatusEnum.READY
+        )
+        if resource_ids:
+            query = query.filter(ResourceDB.id.in_(resource_ids))
+        rows = query.all()
+        return [row.id for row in rows], sum(row.chunk_count or 0 for row in rows)
+    
+    def _exact_search(self, resource_ids: List[str], query_vector: List[float], k: int) -> List[Tuple[str, Document, float]]:
+        """Rank every chunk of the given resources against the query, returning (id, doc, distance) like Chroma."""
+        stored = self.vectorstore._collection.get(
+            where={"resource_id": {"$in": resource_ids}},
+            include=["embeddings", "documents", "metadatas"]
+        )
+        if not stored["ids"]:
+            return []
+        
+        similarities = np.asarray(stored["embeddings"], dtype=np.float32) @ np.asarray(query_vector, dtype=np.float32)
+        distances = 2.0 - 2.0 * similarities if self._vector_space == "l2" else 1.0 - similarities
+        return [
+            (
+                stored["ids"][i],
+                Document(page_content=stored["documents"][i], metadata=stored["metadatas"][i]),
+                float(distances[i])
+            )
+            for i in np.argsort(distances)[:k]
+        ]
+    
+    def _vector_search(self, where_filter: Dict[str, Any], query_vector: List[float], k: int) -> List[Tuple[str, Document, float]]:
+        """Query the HNSW index, returning (id, doc, distance) tuples in rank order."""
+        found = self.vectorstore._collection.query(
+            query_embeddings=[query_vector],
+            n_results=k,
+            where=where_filter,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [
+            (chunk_id, Document(page_content=document, metadata=metadata), distance)
+            for chunk_id, document, metadata, distance in zip(
+                found["ids"][0], found["documents"][0], found["metadatas"][0], found["distances"][0]
+            )
+        ]
+    
+    def _retrieve(
         self,
+        db: Session,
         project_id: str,
-        message: str,
-        resource_ids: Optional[List[str]] = None,
-        conversation_history: Optional[List[ChatMessage]] = None
-    ) -> Dict[str, Any]:
-        """Chat with the RAG system for a specific project."""
-        
-        # Build filter for this project
-        if resource_ids:
-            where_filter = {
-                "$and": [
-                    {"project_id": project_id},
-                    {"resource_id": {"$in": resource_ids}}
-                ]
-            }
-        else:
-            where_filter = {"project_id": project_id}
+        query_vector: List[float],
+        resource_ids: Optional[List[str]] = None
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """Search the vector store and return (context_parts, sources)."""
+        ready_ids, chunk_total = self._ready_chunks(db, project_id, resource_ids)
+        if not chunk_total:
+            return [], []
+        k = min(self.top_k, chunk_total)
         
         try:
-            results = self.vectorstore.similarity_search_with_score(
-                message,
-                k=self.settings.top_k,
-                filter=where_filter
-            )
+            if resource_ids and chunk_total <= EXACT_SEARCH_MAX_CHUNKS:
+                results = self._exact_search(ready_ids, query_vector, k)
+            else:
+                # Build filter for this project
+                if resource_ids:
+                    where_filter = {
+                        "$and": [
+                            {"project_id": project_id},
+                            {"resource_id": {"$in": ready_ids}}
+                        ]
+                    }
+                else:
+                    where_filter = {"project_id": project_id}
+                results = self._vector_search(where_filter, query_vector, k)
         except Exception:
             results = []
         
-        if not results:
-            return {
-                "answer": "I don't have any resources to search. Please add some URLs first.",
-                "sources": []
-            }
+        # Chroma holds excerpts; swap in the full text (older chunks were stored whole in Chroma)
+        full_texts = self._load_chunk_texts(db, [chunk_id for chunk_id, _, _ in results]) if results else {}
+        results = [
+            (Document(page_content=full_texts.get(chunk_id, doc.page_content), metadata=doc.metadata), distance)
+            for chunk_id, doc, distance in results
+        ]
+        
+        selected = self._select_context(results)
+        
+        # Embeddings are normalized, so cosine similarity is 1 - d for cosine (and ip) distance
+        # and 1 - d / 2 for squared L2
+        distances = np.fromiter((distance for _, _, distance in selected), dtype=np.float32, count=len(selected))
+        scale = 0.5 if self._vector_space == "l2" else 1.0
+        similarities = np.clip(1.0 - distances * scale, 0.0, 1.0).tolist()
         
-        context_parts = []
         sources = []
-        for doc, distance in results:
-            context_parts.append(f"[Source: {doc.metadata.get('url', 'Unknown')}]\n{doc.page_content}")
-            similarity = 1 / (1 + float(distance))
+        for (doc, _, _), similarity in zip(selected, similarities):
             sources.append({
                 "url": doc.metadata.get("url", ""),
                 "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
                 "score": similarity
             })
         
+        # Context follows document order rather than rank so the same chunks give the same prompt;
+        # consecutive chunks of a resource are merged into one passage
+        passages = []
+        previous, previous_end = None, None
+        for doc, text, _ in sorted(
+            selected,
+            key=lambda r: (r[0].metadata.get("resource_id", ""), r[0].metadata.get("chunk_index", 0))
+        ):
+            metadata = doc.metadata
+            start = metadata.get("start_index")
+            if (
+                previous is not None
+                and previous.get("resource_id") == metadata.get("resource_id")
+                and previous.get("chunk_index", 0) + 1 == metadata.get("chunk_index", 0)
+            ):
+                overlap = previous_end - start if previous_end is not None and start is not None else None
+                passages[-1][1] = _join_overlapping(passages[-1][1], text, overlap, self.settings.chunk_overlap)
+            else:
+                passages.append([metadata.get("url", "Unknown"), text])
+            previous = metadata
+            previous_end = start + len(text) if start is not None else None
+        
+        context_parts = [f"[Source: {url}]\n{text}" for url, text in passages]
+        return context_parts, sources
+    
+    def _select_context(self, results: List[Tuple[Any, float]]) -> List[Tuple[Any, str, float]]:
+        """Drop near-duplicate chunks and cap the context at max_context_tokens, keeping rank order.
+        
+        Returns (doc, text, distance) tuples, where text is the chunk content, truncated for the
+        last chunk that only partly fits.
+        """
+        selected = []
+        seen_shingles = []
+        budget = self.settings.max_context_tokens
+        for doc, distance in results:
+            if budget <= 0:
+                break
+            shingles = _shingles(doc.page_content)
+            if any(_jaccard(shingles, other) > NEAR_DUPLICATE_JACCARD for other in seen_shingles):
+                continue
+            seen_shingles.append(shingles)
+            
+            tokens = self.encoding.encode(doc.page_content)
+            text = doc.page_content if len(tokens) <= budget else self.encoding.decode(tokens[:budget])
+            budget -= len(tokens)
+            selected.append((doc, text, distance))
+        return selected
+    
+    def _build_chat_inputs(
+        self,
+        db: Session,
+        project_id: str,
+        message: str,
+        query_vector: List[float],
+        resource_ids: Optional[List[str]] = None,
+        conversation_history: Optional[List[ChatMessage]] = None
+    ) -> Tuple[Optional[Dict[str, str]], List[Dict[str, Any]]]:
+        """Retrieve context for a message and build the prompt inputs and sources.
+        
+        Returns (None, []) when there is nothing to search.
+        """
+        scope = self._chat_scope(project_id, resource_ids)
+        generation = self._retrieval_cache.generation(scope)
+        retrieved = self._retrieval_cache.get(scope, query_vector)
+        if retrieved is None:
+            retrieved = self._retrieve(db, project_id, query_vector, resource_ids)
+            if retrieved[0]:
+                self._retrieval_cache.put(scope, query_vector, retrieved, generation)
+        context_parts, sources = retrieved
+        
+        if not context_parts:
+            return None, []
+        
         context = "\n\n---\n\n".join(context_parts)
         
         history = ""
@@ -502,22 +1054,100 @@ Previous conversation:
                 history_parts.append(f"{msg.role}: {msg.content}")
             history = "\n".join(history_parts)
         
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", self.system_prompt),
-            ("human", "{question}")
-        ])
-        
-        chain = prompt | self.llm
-        response = await chain.ainvoke({
+        inputs = {
             "context": context,
             "history": history,
             "question": message
-        })
+        }
+        return inputs, sources
+    
+    @property
+    def chat_chain(self):
+        """Lazy build the prompt | LLM chain shared by all chat requests."""
+        if self._chat_chain is None:
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", self.system_prompt),
+                ("system", "Context:\n{context}"),
+                ("system", "Previous conversation:\n{history}"),
+                ("human", "{question}")
+            ])
+            self._chat_chain = prompt | self.llm
+        return self._chat_chain
+    
+    async def chat(
+        self,
+        db: Session,
+        project_id: str,
+        message: str,
+        resource_ids: Optional[List[str]] = None,
+        conversation_history: Optional[List[ChatMessage]] = None
+    ) -> Dict[str, Any]:
+        """Chat with the RAG system for a specific project."""
+        query_vector = await self._run_embedding(self.embeddings.embed_query, message)
+        # Answers depend on history, so only standalone questions are cached
+        answer_scope = None
+        if not conversation_history:
+            answer_scope = self._chat_scope(project_id, resource_ids)
+            answer_generation = self._answer_cache.generation(answer_scope)
+            cached = self._answer_cache.get(answer_scope, query_vector)
+            if cached is not None:
+                return cached
         
-        return {
+        inputs, sources = await asyncio.to_thread(
+            self._build_chat_inputs,
+            db, project_id, message, query_vector, resource_ids, conversation_history
+        )
+        if inputs is None:
+            return {
+                "answer": NO_RESOURCES_ANSWER,
+                "sources": []
+            }
+        
+        response = await self.chat_chain.ainvoke(inputs)
+        
+        result = {
             "answer": response.content,
             "sources": sources
         }
+        if answer_scope is not None:
+            self._answer_cache.put(answer_scope, query_vector, result, answer_generation)
+        return result
+    
+    async def prepare_chat(
+        self,
+        db: Session,
+        project_id: str,
+        message: str,
+        resource_ids: Optional[List[str]] = None,
+        conversation_history: Optional[List[ChatMessage]] = None
+    ) -> Tuple[Optional[Dict[str, str]], List[Dict[str, Any]]]:
+        """Embed a message and retrieve its context, returning the prompt inputs and sources.
+        
+        This is the only part of a streamed chat that needs the database, so it runs
+        while the request's session is still open.
+        """
+        query_vector = await self._run_embedding(self.embeddings.embed_query, message)
+        return await asyncio.to_thread(
+            self._build_chat_inputs,
+            db, project_id, message, query_vector, resource_ids, conversation_history
+        )
+    
+    async def chat_stream(
+        self,
+        inputs: Optional[Dict[str, str]],
+        sources: List[Dict[str, Any]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the answer for prepare_chat's result as {"delta": ...} chunks followed by a final {"sources": [...]}."""
+        if inputs is None:
+            yield {"delta": NO_RESOURCES_ANSWER}
+            yield {"sources": []}
+            return
+        
+        async for chunk in self.chat_chain.astream(inputs):
+            if chunk.content:
+                yield {"delta": chunk.content}
+        
+        yield {"sources": sources}
 
 
 # Singleton instance
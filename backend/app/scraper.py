@@ -1,107 +1,433 @@
 import asyncio
-import requests
-from bs4 import BeautifulSoup
-from typing import Optional, Tuple
+import time
+from email.utils import parsedate_to_datetime
+import aiohttp
+from cachetools import TTLCache
+from lxml import etree
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 from urllib.parse import urlparse
 import re
 
 
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Subtrees whose text is never part of the page content
+_SKIP_TAGS = frozenset({
+    "script", "style", "nav", "header", "footer", "aside", "form",
+    "noscript", "svg", "iframe", "template",
+})
+
+# Common content containers, in order of preference
+CONTENT_SELECTORS = [
+    "article",
+    "main",
+    '[role="main"]',
+    ".content",
+    ".post-content",
+    ".article-content",
+    ".entry-content",
+    "#content",
+    ".markdown-body",
+    ".prose",
+]
+# Selector rank (lower is preferred) by the tag, role, class or id it matches
+_TAG_HITS = {s: rank for rank, s in enumerate(CONTENT_SELECTORS) if s.isalpha()}
+_ROLE_HITS = {s[7:-2]: rank for rank, s in enumerate(CONTENT_SELECTORS) if s.startswith("[role=")}
+_CLASS_HITS = {s[1:]: rank for rank, s in enumerate(CONTENT_SELECTORS) if s.startswith(".")}
+_ID_HITS = {s[1:]: rank for rank, s in enumerate(CONTENT_SELECTORS) if s.startswith("#")}
+
+# A container needs more text than this to count as the page content
+MIN_CONTENT_CHARS = 200
+
+# Bytes handed to the parser at a time while the body downloads
+_FEED_CHUNK_SIZE = 65536
+
+# Statuses a server uses to ask clients to slow down, and the longest Retry-After honoured
+_THROTTLE_STATUSES = frozenset({429, 503})
+_MAX_RETRY_AFTER = 60.0
+
+
+def _clean_text(text: str) -> str:
+    """Collapse whitespace runs and trim the ends."""
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class _LxmlContentTarget:
+    """lxml parser target that collects a page's title and text in a single pass.
+    
+    Text of skipped subtrees is dropped as it streams by; every other text node is
+    appended to one buffer, and the first element matching each content selector
+    (keyed by its rank) plus <body> is recorded as a [start, end) span of it. The first
+    <h1>'s text is collected on its own, even inside a skipped <header> or <nav>, since
+    it stands in for a missing title.
+    
+    done turns True as soon as the content and title are settled, so the caller can
+    stop feeding the rest of the page.
+    """
+    
+    def __init__(self):
+        self.parts: List[str] = []
+        self.title_parts: List[str] = []
+        self.spans: Dict[Union[int, str], List[Optional[int]]] = {}
+        self._open: List[List[Union[int, str]]] = []
+        self._skip_depth = 0
+        self._in_title = False
+        self.h1_parts: List[str] = []
+        self._in_h1 = False
+        self._h1_closed = False
+        self._cleaned: Dict[int, str] = {}
+        self.done = False
+    
+    def _keys(self, tag: str, attrib) -> List[Union[int, str]]:
+        keys: List[Union[int, str]] = []
+        if tag == "body":
+            keys.append(tag)
+        if tag in _TAG_HITS:
+            keys.append(_TAG_HITS[tag])
+        role = attrib.get("role")
+        if role in _ROLE_HITS:
+            keys.append(_ROLE_HITS[role])
+        for name in attrib.get("class", "").split():
+            if name in _CLASS_HITS:
+                keys.append(_CLASS_HITS[name])
+        element_id = attrib.get("id")
+        if element_id in _ID_HITS:
+            keys.append(_ID_HITS[element_id])
+        return keys
+    
+    def start(self, tag: str, attrib):
+        if tag == "h1" and not self._in_h1 and not self._h1_closed:
+            self._in_h1 = True
+        if self._skip_depth or tag in _SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        opened = [key for key in self._keys(tag, attrib) if key not in self.spans]
+        for key in opened:
+            self.spans[key] = [len(self.parts), None]
+        self._open.append(opened)
+        if tag == "title":
+            self._in_title = True
+    
+    def end(self, tag: str):
+        settled = False
+        if tag == "h1" and self._in_h1:
+            self._in_h1 = False
+            self._h1_closed = settled = True
+        if self._skip_depth:
+            self._skip_depth -= 1
+        else:
+            closed = self._open.pop()
+            for key in closed:
+                self.spans[key][1] = len(self.parts)
+            if tag == "title":
+                self._in_title = False
+            settled = settled or bool(closed)
+        if settled and not self.done:
+            # A blank <title> doesn't count: _extract_title falls back to the <h1> then
+            has_title = bool("".join(self.title_parts).strip()) or self._h1_closed
+            self.done = has_title and self.content(final=False) is not None
+    
+    def data(self, data: str):
+        if self._in_h1:
+            self.h1_parts.append(data)
+        if self._skip_depth:
+            return
+        if self._in_title:
+            self.title_parts.append(data)
+        else:
+            self.parts.append(data)
+    
+    def close(self):
+        return self
+    
+    def text(self, key: Union[int, str]) -> Optional[str]:
+        """Return the raw text of the element recorded under key, if one was seen."""
+        span = self.spans.get(key)
+        if span is None:
+            return None
+        start, end = span
+        return "".join(self.parts[start:end])
+    
+    def content(self, final: bool = True) -> Optional[str]:
+        """Return the cleaned text of the preferred content container, if any qualifies.
+        
+        With final=False the answer is withheld (None) while a container that is still
+        open or not yet seen could take precedence.
+        """
+        for rank in range(len(CONTENT_SELECTORS)):
+            span = self.spans.get(rank)
+            if span is None or span[1] is None:
+                if final:
+                    continue
+                return None
+            if rank not in self._cleaned:
+                self._cleaned[rank] = _clean_text(self.text(rank))
+            if len(self._cleaned[rank]) > MIN_CONTENT_CHARS:
+                return self._cleaned[rank]
+        return None
+
+
+class _RateLimiter:
+    """Token bucket allowing rate requests per second, in bursts of up to rate."""
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Wait until a request may be sent."""
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1
+                self._updated = time.monotonic()
+            self._tokens -= 1
+
+
+class _CachedPage(NamedTuple):
+    title: str
+    content: str
+    etag: str
+    last_modified: str
+    fetched_at: float
+
+
 class WebScraper:
     """Web scraper for extracting content from URLs."""
     
-    def __init__(self):
+    def __init__(
+        self,
+        cache_size: int = 1024,
+        cache_ttl: float = 3600,
+        cache_max_chars: int = 32 * 1024 * 1024,
+        max_retries: int = 2,
+        retry_backoff: float = 0.3,
+        max_bytes: int = 5 * 1024 * 1024,
+        host_rate: float = 4,
+        host_rates: Optional[Dict[str, float]] = None
+    ):
         self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+            "Accept": "text/html,application/xhtml+xml",
+            "Accept-Language": "en-US,en;q=0.5",
+            # aiohttp decodes br bodies when brotli is installed
+            "Accept-Encoding": "gzip, deflate, br"
         }
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        # Upper bound on a (decompressed) response body
+        self.max_bytes = max_bytes
+        # Requests per second sent to one host, with per-host overrides keyed by netloc
+        if host_rate <= 0 or any(rate <= 0 for rate in (host_rates or {}).values()):
+            raise ValueError("Host rates must be greater than 0")
+        self.host_rate = host_rate
+        self.host_rates: Dict[str, float] = dict(host_rates or {})
+        # Limiters of hosts not scraped for a minute are dropped; a new one starts with a full bucket
+        self._limiters: TTLCache = TTLCache(maxsize=cache_size, ttl=60)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_lock = asyncio.Lock()
+        # Recently scraped pages with their validators for conditional re-fetches, bounded by
+        # their total text length; a single page may take at most 1/16 of it
+        self._cache: TTLCache = TTLCache(
+            maxsize=cache_max_chars,
+            ttl=cache_ttl,
+            getsizeof=lambda page: len(page.title) + len(page.content)
+        )
+        self._max_cached_page_chars = cache_max_chars // 16
     
-    async def scrape_url(self, url: str) -> Tuple[str, str]:
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Lazy create the shared HTTP session, keeping connections and DNS lookups alive between scrapes."""
+        if self._session is None:
+            async with self._session_lock:
+                if self._session is None:
+                    self._session = aiohttp.ClientSession(
+                        connector=aiohttp.TCPConnector(limit=64, limit_per_host=32, ttl_dns_cache=300),
+                        headers=self.headers,
+                        timeout=aiohttp.ClientTimeout(total=30)
+                    )
+        return self._session
+    
+    async def startup(self):
+        """Open the shared HTTP session up front so the first scrape doesn't pay for it."""
+        await self._get_session()
+    
+    async def shutdown(self):
+        """Close the shared HTTP session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def scrape_url(self, url: str, max_age: Optional[float] = None) -> Tuple[str, str]:
         """
         Scrape content from a URL.
         Returns tuple of (title, content).
+        
+        A cached result younger than max_age seconds (any cached result when None) is
+        returned without a request; an older one is revalidated with a conditional GET.
         """
+        cached = self._cache.get(url)
+        if cached is not None and (max_age is None or time.monotonic() - cached.fetched_at <= max_age):
+            return cached.title, cached.content
+        
         try:
-            # Run in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.get(url, headers=self.headers, timeout=30)
-            )
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, "html.parser")
-            
-            # Extract title
-            title = self._extract_title(soup, url)
-            
-            # Remove unwanted elements
-            for element in soup.find_all(["script", "style", "nav", "header", "footer", "aside", "form"]):
-                element.decompose()
-            
-            # Extract main content
-            content = self._extract_content(soup)
-            
-            if not content.strip():
-                raise ValueError("No content could be extracted from the URL")
-            
-            return title, content
-            
-        except requests.RequestException as e:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    page = await self._fetch(url, cached)
+                    break
+                except aiohttp.ClientConnectionError:
+                    # Dropped or refused connections are usually transient
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+                except aiohttp.ClientResponseError as e:
+                    if e.status not in _THROTTLE_STATUSES or attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self._retry_delay(e.headers, attempt))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise ValueError(f"Failed to fetch URL: {str(e)}")
         except Exception as e:
             raise ValueError(f"Failed to scrape URL: {str(e)}")
+        
+        if len(page.title) + len(page.content) <= self._max_cached_page_chars:
+            self._cache[url] = page
+        else:
+            self._cache.pop(url, None)
+        return page.title, page.content
+    
+    def _limiter(self, url: str) -> _RateLimiter:
+        """Return the rate limiter for the URL's host."""
+        host = urlparse(url).netloc
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = _RateLimiter(self.host_rates.get(host, self.host_rate))
+        # Re-inserting restarts the TTL, so only idle hosts expire
+        self._limiters[host] = limiter
+        return limiter
     
-    def _extract_title(self, soup: BeautifulSoup, url: str) -> str:
+    def _retry_delay(self, headers, attempt: int) -> float:
+        """Seconds to wait before retrying a throttled request, honouring Retry-After."""
+        retry_after = (headers or {}).get("Retry-After", "").strip()
+        delay = None
+        if retry_after.isdigit():
+            delay = float(retry_after)
+        elif retry_after:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                pass
+        if delay is None:
+            delay = self.retry_backoff * 2 ** attempt
+        return min(max(delay, 0.0), _MAX_RETRY_AFTER)
+    
+    async def _fetch(self, url: str, cached: Optional[_CachedPage]) -> _CachedPage:
+        """Fetch and parse a page, reusing cached when the server answers 304 Not Modified."""
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        
+        session = await self._get_session()
+        await self._limiter(url).acquire()
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                return cached._replace(fetched_at=time.monotonic())
+            response.raise_for_status()
+            
+            # Reject PDFs, images and other binaries before spending any parse work on them
+            content_type = response.headers.get("Content-Type", "").lower()
+            if content_type and "html" not in content_type and "xml" not in content_type:
+                raise ValueError(f"Unsupported content-type: {content_type}")
+            if response.content_length is not None and response.content_length > self.max_bytes:
+                raise ValueError(f"Response exceeds {self.max_bytes} bytes")
+            etag = response.headers.get("ETag", "")
+            last_modified = response.headers.get("Last-Modified", "")
+            
+            # Parse while the body downloads, and stop once the content is settled.
+            # Only a declared charset is set here; otherwise libxml2 detects it
+            target = _LxmlContentTarget()
+            parser = etree.HTMLParser(target=target, encoding=response.charset)
+            pending = b""
+            received = 0
+            async for chunk in response.content.iter_chunked(_FEED_CHUNK_SIZE):
+                received += len(chunk)
+                if received > self.max_bytes:
+                    raise ValueError(f"Response exceeds {self.max_bytes} bytes")
+                # libxml2's push parser loses the rest of the page when a chunk ends
+                # inside a </script> tag, so only feed up to the last complete tag
+                pending += chunk
+                cut = pending.rfind(b">") + 1
+                if cut:
+                    parser.feed(pending[:cut])
+                    pending = pending[cut:]
+                if target.done:
+                    break
+            else:
+                if pending:
+                    parser.feed(pending)
+        parser.close()
+        
+        # Extract title
+        title = self._extract_title(target, url)
+        
+        # Extract main content
+        content = self._extract_content(target)
+        
+        if not content.strip():
+            raise ValueError("No content could be extracted from the URL")
+        
+        return _CachedPage(title, content, etag, last_modified, time.monotonic())
+    
+    async def scrape_urls(
+        self,
+        urls: List[str],
+        concurrency: int = 16,
+        max_age: Optional[float] = None
+    ) -> List[Union[Tuple[str, str], Exception]]:
+        """Scrape several URLs concurrently, returning (title, content) or the raised exception per URL."""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def scrape(url: str):
+            async with semaphore:
+                return await self.scrape_url(url, max_age=max_age)
+        
+        return await asyncio.gather(*(scrape(url) for url in urls), return_exceptions=True)
+    
+    def _extract_title(self, target: _LxmlContentTarget, url: str) -> str:
         """Extract page title."""
         # Try meta title
-        if soup.title and soup.title.string:
-            return soup.title.string.strip()
+        title = "".join(target.title_parts).strip()
+        if title:
+            return title
         
         # Try h1
-        h1 = soup.find("h1")
+        h1 = "".join(target.h1_parts).strip()
         if h1:
-            return h1.get_text().strip()
+            return h1
         
         # Fallback to domain
         parsed = urlparse(url)
         return parsed.netloc
     
-    def _extract_content(self, soup: BeautifulSoup) -> str:
+    def _extract_content(self, target: _LxmlContentTarget) -> str:
         """Extract main content from page."""
         # Try common content containers
-        content_selectors = [
-            "article",
-            "main",
-            '[role="main"]',
-            ".content",
-            ".post-content",
-            ".article-content",
-            ".entry-content",
-            "#content",
-            ".markdown-body",
-            ".prose",
-        ]
-        
-        for selector in content_selectors:
-            element = soup.select_one(selector)
-            if element:
-                text = self._clean_text(element.get_text())
-                if len(text) > 200:  # Ensure we have meaningful content
-                    return text
+        text = target.content()
+        if text is not None:
+            return text
         
         # Fallback to body
-        body = soup.find("body")
-        if body:
-            return self._clean_text(body.get_text())
+        body = target.text("body")
+        if body is not None:
+            return _clean_text(body)
         
         return ""
-    
-    def _clean_text(self, text: str) -> str:
-        """Clean extracted text."""
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text)
-        # Remove leading/trailing whitespace
-        text = text.strip()
-        return text
 
 
 # Singleton instance
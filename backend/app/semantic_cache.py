@@ -0,0 +1,125 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+_BucketKey = Tuple[Hashable, int, int]
+
+
+class SemanticCache:
+    """Cache keyed by query embeddings, matching near-duplicate queries.
+    
+    Vectors are hashed into buckets with random-projection LSH (several tables of
+    a few hyperplanes each); lookups only compare cosine similarity against the
+    entries sharing a bucket with the query. Vectors are expected to be L2-normalized.
+    
+    At most maxsize entries are kept; since every entry lives for the same ttl, the
+    oldest ones are evicted first. Each scope has a generation that invalidate()
+    advances, so a value computed before an invalidation is not stored after it.
+    """
+    
+    def __init__(
+        self,
+        threshold: float = 0.97,
+        ttl: float = 300,
+        maxsize: int = 1024,
+        num_tables: int = 4,
+        num_planes: int = 8,
+        seed: int = 0
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.num_tables = num_tables
+        self.num_planes = num_planes
+        self._rng = np.random.default_rng(seed)
+        self._planes: Optional[np.ndarray] = None
+        self._bit_weights = 1 << np.arange(num_planes)
+        # Entry id -> (vector, expires at, value, bucket keys), in insertion (= expiry) order
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, float, Any, List[_BucketKey]]]" = OrderedDict()
+        self._buckets: Dict[_BucketKey, Set[int]] = {}
+        self._ids = itertools.count()
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()
+    
+    def _signatures(self, vector: np.ndarray) -> List[int]:
+        """Hash a vector to one bucket signature per table."""
+        if self._planes is None:
+            self._planes = self._rng.standard_normal((self.num_tables, self.num_planes, vector.shape[0]))
+        bits = (self._planes @ vector) > 0
+        return (bits @ self._bit_weights).tolist()
+    
+    def _drop(self, entry_id: int):
+        """Remove an entry and any bucket it leaves empty."""
+        for key in self._entries.pop(entry_id)[3]:
+            ids = self._buckets.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._buckets[key]
+    
+    def _evict(self, now: float):
+        """Drop expired entries and the oldest ones beyond maxsize."""
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if entry[1] > now and len(self._entries) <= self.maxsize:
+                break
+            self._drop(entry_id)
+    
+    def generation(self, scope: Hashable) -> int:
+        """Return the scope's current generation, to hand back to put() with the computed value."""
+        with self._lock:
+            generation = self._generations.get(scope)
+            if generation is None:
+                generation = self._generations[scope] = next(self._clock)
+                if len(self._generations) > self.maxsize:
+                    self._generations.popitem(last=False)
+            else:
+                self._generations.move_to_end(scope)
+            return generation
+    
+    def get(self, scope: Hashable, vector: List[float]) -> Optional[Any]:
+        """Return the cached value for the most similar live entry in scope, if any."""
+        query = np.asarray(vector, dtype=np.float32)
+        best_score, best_value = self.threshold, None
+        with self._lock:
+            self._evict(time.monotonic())
+            for table, signature in enumerate(self._signatures(query)):
+                for entry_id in self._buckets.get((scope, table, signature), ()):
+                    cached, _, value, _ = self._entries[entry_id]
+                    score = float(cached @ query)
+                    if score >= best_score:
+                        best_score, best_value = score, value
+        return best_value
+    
+    def put(self, scope: Hashable, vector: List[float], value: Any, generation: Optional[int] = None):
+        """Store a value for a query vector in scope.
+        
+        When generation is given and the scope was invalidated since it was read, the
+        value is stale and is dropped.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and self._generations.get(scope) != generation:
+                return
+            keys = [(scope, table, signature) for table, signature in enumerate(self._signatures(query))]
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (query, now + self.ttl, value, keys)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(entry_id)
+            self._evict(now)
+    
+    def invalidate(self, predicate):
+        """Drop every entry whose scope matches predicate(scope) and advance those scopes' generations."""
+        with self._lock:
+            for scope in [s for s in self._generations if predicate(s)]:
+                self._generations[scope] = next(self._clock)
+            stale = {entry_id for key, ids in self._buckets.items() if predicate(key[0]) for entry_id in ids}
+            for entry_id in stale:
+                self._drop(entry_id)